@@ -1,6 +1,69 @@
-﻿import sympy
+﻿import builtins
+import ctypes
+import functools
+import math
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import types
+from math import floor, log10
+import numpy as np
+import sympy
+from sympy.codegen.cfunctions import hypot as sympy_hypot
 from sympy.parsing.sympy_parser import parse_expr, standard_transformations, convert_xor
 
+try:
+    import numba
+except ImportError:
+    # Numba is optional; without it equations are evaluated through plain lambdify
+    numba = None
+
+try:
+    # Jacobian by forward accumulation over the CSE'd expression (SymPy >= 1.14)
+    from sympy.simplify._cse_diff import _forward_jacobian
+except ImportError:
+    _forward_jacobian = None
+
+try:
+    import symengine
+except ImportError:
+    # SymEngine is optional; without it parsing and differentiation use pure SymPy
+    symengine = None
+
+# Equations SymEngine's parser is trusted with: identifiers, decimal numbers
+# and arithmetic. SymEngine crashes the interpreter on some other characters
+# (&, |, ~) and reads literals such as 0x10, 1_000 or 1j differently from
+# parse_expr, so anything else goes to SymPy. A number directly followed by a
+# letter, digit or dot (2e, 0x10) is rejected too
+_SYMENGINE_SAFE = re.compile(
+    r"(?:\s+"
+    r"|[A-Za-z_][A-Za-z0-9_]*"
+    r"|(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?(?![A-Za-z0-9_.])"
+    r"|[-+*/^().,])*"
+)
+
+# C compiler used to build evaluation kernels when Numba is not installed
+_C_COMPILER = shutil.which("cc")
+
+# Define transformations to handle ^ as power
+_TRANSFORMATIONS = standard_transformations + (convert_xor,)
+
+# Define constants to be recognized
+_LOCAL_DICT = {'pi': sympy.pi, 'e': sympy.E}
+
+# Namespace parse_expr evaluates equations in. parse_expr rebuilds this
+# (including a "from sympy import *") on every call unless one is passed in,
+# so build it once here the same way
+_GLOBAL_DICT = {}
+exec('from sympy import *', _GLOBAL_DICT)
+for _name, _obj in vars(builtins).items():
+    if isinstance(_obj, types.BuiltinFunctionType):
+        _GLOBAL_DICT[_name] = _obj
+_GLOBAL_DICT['max'] = sympy.Max
+_GLOBAL_DICT['min'] = sympy.Min
+
 def round_to_n_sig_figs(value, n=3):
     """
     Round a number to n total significant figures (including the first non-zero digit).
@@ -13,77 +76,508 @@ def round_to_n_sig_figs(value, n=3):
     if value == 0:
         return 0
     
-    import math
-    # Find the order of magnitude
-    magnitude = math.floor(math.log10(abs(value)))
-    # Round to n total significant figures
-    # That's (magnitude - n + 1) decimal places
-    decimal_places = magnitude - n + 1
-    return round(value, -decimal_places)
+    # Round to n total significant figures, i.e. to
+    # (n - 1 - order of magnitude) decimal places
+    return round(value, n - 1 - floor(log10(abs(value))))
+
+@functools.lru_cache(maxsize=None)
+def parse_equation(raw_eq):
+    """
+    Parse raw_eq into a SymPy expression.
+    Uses SymEngine's C++ parser when available and falls back to SymPy's
+    parse_expr for anything SymEngine does not understand.
+    Results are cached, so re-entering the same equation skips parsing.
+    """
+    if symengine is not None and _SYMENGINE_SAFE.fullmatch(raw_eq):
+        try:
+            expr = symengine.sympify(raw_eq.replace('^', '**'))
+            # SymEngine turns functions it does not know into undefined functions,
+            # leave those to SymPy
+            if not expr.atoms(symengine.FunctionSymbol):
+                return expr._sympy_()
+        except Exception:
+            pass
+    
+    # parse_expr evaluates in local_dict, so pass a copy: input such as
+    # "(pi := 3) + x" would otherwise redefine pi for the rest of the session
+    return parse_expr(raw_eq, local_dict=dict(_LOCAL_DICT), global_dict=_GLOBAL_DICT,
+                      transformations=_TRANSFORMATIONS)
 
 def get_equation():
     print("Enter your equation (use ^ for powers):")
     raw_eq = input("> ").strip()
-    # Define transformations to handle ^ as power
-    transformations = standard_transformations + (convert_xor,)
-    
-    # Define constants to be recognized
-    local_dict = {'pi': sympy.pi, 'e': sympy.E}
     
     try:
         # Parse the equation
-        expr = parse_expr(raw_eq, local_dict=local_dict, transformations=transformations)
-        return expr
+        expr = parse_equation(raw_eq)
+        return raw_eq, expr
     except Exception as e:
         print(f"Error parsing equation: {e}")
-        return None
+        return raw_eq, None
 
-def get_user_inputs(variables):
-    values = {}
-    uncertainties = {}
-    
-    # Sort variables by name for consistent prompting
-    sorted_vars = sorted(variables, key=lambda s: s.name)
+def get_user_inputs(sorted_vars):
+    # sorted_vars is already sorted by name for consistent prompting.
+    # Values and uncertainties are returned as float64 arrays in that order
+    values = np.empty(len(sorted_vars))
+    uncertainties = np.empty_like(values)
     
     print(f"\nDetected variables: {', '.join([str(v) for v in sorted_vars])}")
     
-    for var in sorted_vars:
+    for i, var in enumerate(sorted_vars):
         while True:
             try:
                 val = float(input(f"Enter value for {var}: "))
                 unc = float(input(f"Enter uncertainty for {var}: "))
-                values[var] = val
-                uncertainties[var] = unc
+                values[i] = val
+                uncertainties[i] = unc
                 break
             except ValueError:
                 print("Invalid input. Please enter numeric values.")
                 
     return values, uncertainties
 
-def calculate_uncertainty(expr, values, uncertainties):
-    # Calculate the value of the expression
-    # subs returns a SymPy object (Float, Integer, etc.), convert to float for display
-    calculated_value = float(expr.subs(values))
+class Dual:
+    """
+    A value together with its gradient with respect to every variable.
+    Evaluating an expression on Dual inputs seeded with unit gradients
+    (forward-mode automatic differentiation) yields the value and all
+    partial derivatives in a single pass, without symbolic differentiation.
+    """
+    __slots__ = ('val', 'grad')
+    
+    def __init__(self, val, grad):
+        self.val = val
+        self.grad = grad
+    
+    def __add__(self, other):
+        if isinstance(other, Dual):
+            return Dual(self.val + other.val, self.grad + other.grad)
+        return Dual(self.val + other, self.grad)
+    
+    __radd__ = __add__
+    
+    def __neg__(self):
+        return Dual(-self.val, -self.grad)
+    
+    def __pos__(self):
+        return self
+    
+    def __sub__(self, other):
+        return self + (-other)
+    
+    def __rsub__(self, other):
+        return (-self) + other
+    
+    def __mul__(self, other):
+        if isinstance(other, Dual):
+            return Dual(self.val * other.val, self.grad * other.val + other.grad * self.val)
+        return Dual(self.val * other, self.grad * other)
+    
+    __rmul__ = __mul__
+    
+    def __truediv__(self, other):
+        if isinstance(other, Dual):
+            return Dual(self.val / other.val,
+                        (self.grad * other.val - other.grad * self.val) / other.val**2)
+        return Dual(self.val / other, self.grad / other)
+    
+    def __rtruediv__(self, other):
+        return Dual(other / self.val, -other * self.grad / self.val**2)
+    
+    def __pow__(self, other):
+        if isinstance(other, Dual):
+            # x^y = exp(y * log(x))
+            return _dual_exp(other * _dual_log(self))
+        return Dual(self.val**other, other * self.val**(other - 1) * self.grad)
+    
+    def __rpow__(self, other):
+        val = other**self.val
+        return Dual(val, val * math.log(other) * self.grad)
+    
+    def __abs__(self):
+        return self if self.val >= 0 else -self
+    
+    # Comparisons use the value only, so max/min/sign pick the active branch
+    def __eq__(self, other):
+        return self.val == (other.val if isinstance(other, Dual) else other)
+    
+    def __lt__(self, other):
+        return self.val < (other.val if isinstance(other, Dual) else other)
+    
+    def __le__(self, other):
+        return self.val <= (other.val if isinstance(other, Dual) else other)
+    
+    def __gt__(self, other):
+        return self.val > (other.val if isinstance(other, Dual) else other)
+    
+    def __ge__(self, other):
+        return self.val >= (other.val if isinstance(other, Dual) else other)
+
+def _dual_function(f, df):
+    """Lift a scalar function f with derivative df so it also accepts Dual numbers."""
+    def lifted(x):
+        if isinstance(x, Dual):
+            return Dual(f(x.val), df(x.val) * x.grad)
+        return f(x)
+    return lifted
+
+_dual_exp = _dual_function(math.exp, math.exp)
+_dual_log = _dual_function(math.log, lambda x: 1 / x)
+
+def _dual_atan2(y, x):
+    if not isinstance(y, Dual) and not isinstance(x, Dual):
+        return math.atan2(y, x)
+    # d atan2(y, x) = (x dy - y dx) / (x^2 + y^2)
+    yv = y.val if isinstance(y, Dual) else y
+    xv = x.val if isinstance(x, Dual) else x
+    dy = y.grad if isinstance(y, Dual) else 0
+    dx = x.grad if isinstance(x, Dual) else 0
+    return Dual(math.atan2(yv, xv), (xv * dy - yv * dx) / (xv**2 + yv**2))
+
+def _dual_copysign(a, b):
+    # Only used by lambdify for sign(x) as copysign(1, x), which has zero derivative
+    return math.copysign(a, b.val if isinstance(b, Dual) else b)
+
+# Namespace for lambdifying an expression so it can be evaluated on Dual numbers
+_DUAL_NAMESPACE = {
+    'pi': math.pi,
+    'e': math.e,
+    'exp': _dual_exp,
+    'log': _dual_log,
+    'sqrt': _dual_function(math.sqrt, lambda x: 0.5 / math.sqrt(x)),
+    'sin': _dual_function(math.sin, math.cos),
+    'cos': _dual_function(math.cos, lambda x: -math.sin(x)),
+    'tan': _dual_function(math.tan, lambda x: 1 / math.cos(x)**2),
+    'asin': _dual_function(math.asin, lambda x: 1 / math.sqrt(1 - x**2)),
+    'acos': _dual_function(math.acos, lambda x: -1 / math.sqrt(1 - x**2)),
+    'atan': _dual_function(math.atan, lambda x: 1 / (1 + x**2)),
+    'atan2': _dual_atan2,
+    'sinh': _dual_function(math.sinh, math.cosh),
+    'cosh': _dual_function(math.cosh, math.sinh),
+    'tanh': _dual_function(math.tanh, lambda x: 1 / math.cosh(x)**2),
+    'asinh': _dual_function(math.asinh, lambda x: 1 / math.sqrt(x**2 + 1)),
+    'acosh': _dual_function(math.acosh, lambda x: 1 / math.sqrt(x**2 - 1)),
+    'atanh': _dual_function(math.atanh, lambda x: 1 / (1 - x**2)),
+    'copysign': _dual_copysign,
+}
+
+def build_dual_evaluator(expr, vars_tuple):
+    """
+    Compile expr into a function f(x_1, ..., x_n, Δx_1, ..., Δx_n) returning
+    [Q, ΔQ], with the partial derivatives computed by forward-mode automatic
+    differentiation on Dual numbers.
+    """
+    f_dual = sympy.lambdify(vars_tuple, expr, modules=[_DUAL_NAMESPACE], cse=True)
+    n = len(vars_tuple)
+    seeds = np.eye(n)
+    
+    def f(*args):
+        out = f_dual(*[Dual(float(a), seed) for a, seed in zip(args[:n], seeds)])
+        if not isinstance(out, Dual):
+            # Expression does not depend on the variables at this point
+            return [float(out), 0.0]
+        terms = out.grad * np.asarray(args[n:], dtype=np.float64)
+        return [out.val, float(np.hypot.reduce(terms, initial=0.0))]
+    
+    return f
+
+def build_symbolic_evaluator(exprs, args_tuple):
+    """
+    Return a function of the symbols in args_tuple evaluating exprs by
+    substituting values into the SymPy expressions. Slow, only used when the
+    expressions cannot be lambdified.
+    """
+    def f(*args):
+        # xreplace swaps symbols for Floats directly, without the sympify and
+        # pattern matching subs goes through. float() evaluates numerically
+        # itself, so no separate evalf pass is needed
+        fvalues = {v: sympy.Float(a) for v, a in zip(args_tuple, args)}
+        return [float(e.xreplace(fvalues)) for e in exprs]
+    
+    return f
+
+def build_c_evaluator(exprs, vars_tuple):
+    """
+    Generate C code for exprs, compile it into a shared library with the
+    system C compiler and return a ctypes-backed function of the variables in
+    vars_tuple returning the values of exprs.
+    """
+    # Refer to the variables as elements of the input array and share common
+    # subexpressions between all outputs
+    x = sympy.IndexedBase('x', shape=(len(vars_tuple),))
+    exprs = [e.xreplace({v: x[i] for i, v in enumerate(vars_tuple)}) for e in exprs]
+    replacements, reduced = sympy.cse(exprs, symbols=sympy.numbered_symbols('t'))
+    
+    lines = ["#include <math.h>", "",
+             "void kernel(const double *x, double *out)", "{"]
+    for sym, sub_expr in replacements:
+        lines.append(f"    const double {sym} = {sympy.ccode(sub_expr)};")
+    for i, e in enumerate(reduced):
+        lines.append(f"    out[{i}] = {sympy.ccode(e)};")
+    lines.append("}")
+    
+    tmpdir = tempfile.mkdtemp(prefix="uncertainty_")
+    try:
+        src_path = os.path.join(tmpdir, "kernel.c")
+        lib_path = os.path.join(tmpdir, "kernel.so")
+        with open(src_path, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        subprocess.run([_C_COMPILER, "-O3", "-shared", "-fPIC", src_path, "-o", lib_path, "-lm"],
+                       check=True, capture_output=True)
+        lib = ctypes.CDLL(lib_path)
+    finally:
+        # The loaded library stays mapped after its file is removed
+        shutil.rmtree(tmpdir, ignore_errors=True)
     
-    variance = 0
+    kernel = lib.kernel
+    kernel.argtypes = [ctypes.POINTER(ctypes.c_double), ctypes.POINTER(ctypes.c_double)]
+    kernel.restype = None
     
-    # Calculate propagated uncertainty
+    # Argument and result buffers are allocated once and reused on every call
+    args_buf = (ctypes.c_double * len(vars_tuple))()
+    out_buf = (ctypes.c_double * len(exprs))()
+    
+    def f(*args):
+        args_buf[:] = [float(a) for a in args]
+        kernel(args_buf, out_buf)
+        return out_buf[:]
+    
+    f.lib = lib
+    return f
+
+def quadrature(terms):
+    """
+    Return sqrt(t_1^2 + ... + t_k^2) for the SymPy expressions in terms, written
+    as nested hypot calls. hypot scales internally, so squaring very large or
+    small terms cannot overflow or underflow.
+    """
+    if not terms:
+        return sympy.S.Zero
+    # hypot(t, 0) = |t|. Abs would get rewritten for symbols without
+    # assumptions (Abs(exp(x)) becomes exp(re(x))), which neither Numba nor C
+    # can compile
+    result = sympy_hypot(terms[0], 0)
+    for term in terms[1:]:
+        result = sympy_hypot(result, term)
+    return result
+
+def build_evaluator(expr, vars_tuple):
+    """
+    Differentiate expr once and compile the whole propagation formula into a
+    single function f(x_1, ..., x_n, Δx_1, ..., Δx_n) returning [Q, ΔQ], with
+    ΔQ = sqrt( sum( (dQ/dx_i * Δx_i)^2 ) ).
+    Compiling Q and ΔQ together lets common subexpressions be shared between
+    the value and every partial derivative.
+    Uses a Numba JIT-compiled kernel when Numba is installed, then a C kernel
+    when a C compiler is available, otherwise a NumPy lambdified function.
+    Expressions SymPy cannot differentiate in closed form (e.g. Abs, Max) use
+    forward-mode automatic differentiation.
+    """
+    grads = None
+    # symengine.diff crashes the interpreter on re, im and arg
+    if symengine is not None and not expr.has(sympy.re, sympy.im, sympy.arg):
+        try:
+            # Differentiate with SymEngine's C++ core and convert back for lambdify
+            se_expr = symengine.sympify(expr)
+            grads = [symengine.diff(se_expr, v)._sympy_() for v in vars_tuple]
+        except Exception:
+            grads = None
+    if grads is None and _forward_jacobian is not None:
+        try:
+            # Differentiate the shared subexpressions once for all variables
+            grads = list(_forward_jacobian(sympy.Matrix([expr]), vars_tuple))
+        except Exception:
+            grads = None
+    if grads is None:
+        grads = [sympy.diff(expr, v) for v in vars_tuple]
+    
+    if any(g.has(sympy.Derivative) for g in grads):
+        # Symbolic differentiation left unevaluated derivatives behind
+        return build_dual_evaluator(expr, vars_tuple)
+    
+    # One uncertainty symbol per variable. Dummies cannot clash with the
+    # names of the user's variables
+    sigmas = tuple(sympy.Dummy(f'd{v.name}') for v in vars_tuple)
+    args_tuple = vars_tuple + sigmas
+    
+    # Variables with an identically zero partial derivative contribute nothing
+    # to the uncertainty, so leave them out of the formula. They stay
+    # arguments since the value itself may still depend on them
+    unc_expr = quadrature([g * s for g, s in zip(grads, sigmas) if g != sympy.S.Zero])
+    
+    # Numba and C cannot hold integers wider than 64 bits, and every output
+    # must be a float, so turn exact numbers into floats first. 17 significant
+    # digits round-trip every float64, so constants like 1/3 stay exact
+    exprs = tuple(e.xreplace({r: sympy.Float(r, 17) for r in e.atoms(sympy.Rational)})
+                  for e in (expr, unc_expr))
+    
+    if numba is not None:
+        try:
+            f_py = sympy.lambdify(args_tuple, exprs, modules="math", cse=True)
+            signature = numba.types.UniTuple(numba.float64, 2)(*[numba.float64] * len(args_tuple))
+            # Compile eagerly so unsupported functions fall back right here
+            return numba.njit(signature)(f_py)
+        except Exception:
+            pass
+    
+    if _C_COMPILER is not None:
+        try:
+            return build_c_evaluator(exprs, args_tuple)
+        except Exception:
+            pass
+    
+    try:
+        return sympy.lambdify(args_tuple, [expr, unc_expr], modules=["mpmath", "sympy"], cse=True)
+    except Exception:
+        # Nothing can print this expression as code, evaluate it symbolically
+        return build_symbolic_evaluator([expr, unc_expr], args_tuple)
+
+def sorted_variables(expr):
+    """Return the free symbols of expr as a tuple sorted by name."""
+    return tuple(sorted(expr.free_symbols, key=lambda s: s.name))
+
+@functools.lru_cache(maxsize=64)
+def compile_equation(raw_eq, vars_tuple):
+    """
+    Parse, differentiate and compile the equation raw_eq, whose variables
+    sorted by name are vars_tuple.
+    Returns the evaluator from build_evaluator.
+    Results are cached by the equation text, so re-entering an equation skips
+    the whole symbolic pipeline, including JIT compilation.
+    """
+    return build_evaluator(parse_equation(raw_eq), vars_tuple)
+
+def product_evaluator(*args):
+    """
+    Closed-form evaluator for the product of n values, with the same interface
+    as the functions from build_evaluator: takes the n values followed by their
+    n uncertainties and returns [Q, ΔQ].
+    dQ/dx_i is the product of all the other values. It is taken from prefix
+    and suffix products, which is O(n) and needs no division, so zero values
+    are handled like any other. Compiling the product symbolically instead
+    would mean n partials of n - 1 factors each and a JIT compile that takes
+    seconds for a few dozen values.
+    """
+    n = len(args) // 2
+    v = np.asarray(args[:n], dtype=np.float64)
+    u = np.asarray(args[n:], dtype=np.float64)
+    
+    # prefix[i] = v_0 ... v_(i-1), suffix[i] = v_(i+1) ... v_(n-1)
+    prefix = np.concatenate(([1.0], np.cumprod(v[:-1])))
+    suffix = np.concatenate((np.cumprod(v[:0:-1])[::-1], [1.0]))
+    
+    # Same hypot accumulation as the compiled formula, so it cannot overflow
+    return [float(prefix[-1] * v[-1]), float(np.hypot.reduce(prefix * suffix * u, initial=0.0))]
+
+def calculate_uncertainty(f, values, uncertainties):
+    # f is the compiled propagation formula built once per equation, so a
+    # single call returns the value and its propagated uncertainty
     # ΔQ = sqrt( sum( (dQ/dx_i * Δx_i)^2 ) )
-    for var in values:
-        # Partial derivative with respect to the variable
-        partial_derivative = sympy.diff(expr, var)
+    # values and uncertainties are arrays ordered like the variables f was
+    # compiled for
+    out = f(*values, *uncertainties)
+    
+    calculated_value = float(out[0])
+    absolute_uncertainty = float(out[1])
+    
+    return calculated_value, absolute_uncertainty
+
+def _mpmath_real(f, args):
+    """Evaluate f(*args) with mpmath as a float, NaN where it is complex or undefined."""
+    try:
+        return float(f(*args))
+    except (TypeError, ValueError, ZeroDivisionError):
+        return math.nan
+
+def monte_carlo_uncertainty(expr, vars_tuple, values, uncertainties, n_samples=100_000):
+    """
+    Estimate the value and uncertainty of expr by Monte Carlo sampling.
+    values and uncertainties are arrays ordered like vars_tuple. Each variable
+    is drawn n_samples times from Normal(value, uncertainty) and the whole
+    batch is pushed through a NumPy lambdified expr in one call.
+    Returns the sample mean and standard deviation.
+    """
+    f = sympy.lambdify(vars_tuple, expr, modules="numpy", cse=True)
+    
+    rng = np.random.default_rng()
+    # One row of samples per variable, drawn in a single call
+    # The uncertainty is a spread, so its sign does not matter (and a negative
+    # scale is an error for rng.normal)
+    samples = rng.normal(values[:, None], np.abs(uncertainties)[:, None], (len(vars_tuple), n_samples))
+    
+    # Samples outside the domain of expr come out as NaN, which the caller
+    # reports, so NumPy's warnings about them are only noise
+    with np.errstate(all='ignore'):
+        try:
+            out = f(*samples)
+        except (TypeError, NameError):
+            # NumPy has no vectorized version of some functions (e.g. gamma,
+            # erf), evaluate those one sample at a time with mpmath instead
+            f_mp = sympy.lambdify(vars_tuple, expr, modules=["mpmath", "sympy"], cse=True)
+            out = np.vectorize(lambda *x: _mpmath_real(f_mp, x), otypes=[np.float64])(*samples)
+    
+    # Broadcast in case the expression does not depend on the samples
+    out = np.broadcast_to(out, (n_samples,)).astype(np.float64)
+    
+    return float(out.mean()), float(out.std())
+
+def monte_carlo_mode():
+    """Mode where uncertainty is estimated by sampling the inputs instead of from derivatives."""
+    print("\nMonte Carlo Mode")
+    
+    while True:
+        raw_eq, expr = get_equation()
+        if expr is None:
+            continue
         
-        # Evaluate the partial derivative at the given values
-        partial_val = float(partial_derivative.subs(values))
+        vars_tuple = sorted_variables(expr)
         
-        sigma = uncertainties[var]
+        if not vars_tuple:
+            # Case where equation is just constants, e.g. "pi * 2"
+            val = float(expr)
+            print(f"\nComputed value: {val}")
+            print("Absolute uncertainty: 0.0 (No variables)")
+            print("Fractional uncertainty: 0.0")
+        else:
+            values, uncertainties = get_user_inputs(vars_tuple)
+            
+            try:
+                val, abs_unc = monte_carlo_uncertainty(expr, vars_tuple, values, uncertainties)
+                
+                if np.isnan(val):
+                    # e.g. sqrt(x) or log(x) with x = 0.01 ± 1
+                    raise ValueError("samples fell outside the domain of the equation")
+                
+                if val != 0:
+                    frac_unc = abs_unc / abs(val)
+                else:
+                    frac_unc = 0.0
+                
+                # Round to 3 total significant figures
+                val_rounded = round_to_n_sig_figs(val, n=3)
+                abs_unc_rounded = round_to_n_sig_figs(abs_unc, n=3)
+                frac_unc_rounded = round_to_n_sig_figs(frac_unc, n=3)
+                
+                print(f"\nComputed value (sample mean): {val_rounded}")
+                print(f"Absolute uncertainty (sample std): {abs_unc_rounded}")
+                print(f"Fractional uncertainty: {frac_unc_rounded}")
+                
+            except Exception as e:
+                print(f"An error occurred during calculation: {e}")
         
-        term = (partial_val * sigma)**2
-        variance += term
+        # Ask if user wants another calculation in this mode
+        while True:
+            choice = input("\nDo you want another calculation in this mode? (yes/no): ").strip().lower()
+            if choice in {'yes', 'y'}:
+                print("\n" + "="*40 + "\n")
+                break
+            elif choice in {'no', 'n'}:
+                break
+            else:
+                print("Please enter 'yes' or 'no'.")
         
-    absolute_uncertainty = variance**0.5
-    
-    return calculated_value, absolute_uncertainty
+        if choice in {'no', 'n'}:
+            break
 
 def values_only_mode():
     """Mode where user enters values and uncertainties directly without an equation."""
@@ -120,22 +614,15 @@ def values_only_mode():
     
     if choice == '1':
         # Addition/Subtraction
-        val = sum(values)
-        abs_unc = sum(uncertainties)
+        val = float(np.sum(values))
+        abs_unc = float(np.sum(uncertainties))
         operation_str = " + ".join(str(v) for v in values)
     else:
-        # Multiplication/Division
-        val = 1
-        for v in values:
-            val *= v
-        
-        # Relative uncertainties in quadrature
-        rel_unc_sq = 0
-        for v, u in zip(values, uncertainties):
-            if v != 0:
-                rel_unc_sq += (u / abs(v))**2
-        rel_unc = rel_unc_sq**0.5
-        abs_unc = abs(val) * rel_unc
+        # Multiplication/Division, propagated with the same formula as
+        # equation mode, which for a product gives the relative uncertainties
+        # in quadrature
+        val, abs_unc = calculate_uncertainty(product_evaluator, np.asarray(values, dtype=np.float64),
+                                             np.asarray(uncertainties, dtype=np.float64))
         operation_str = " × ".join(str(v) for v in values)
     
     if val != 0:
@@ -161,34 +648,44 @@ def main():
         print("Main Menu:")
         print("1) Equation Mode (enter any equation)")
         print("2) Values-Only Mode (addition or multiplication)")
+        print("3) Monte Carlo Mode (sample an equation)")
         
         while True:
-            mode = input("Choose mode (1 or 2): ").strip()
-            if mode in {'1', '2'}:
+            mode = input("Choose mode (1, 2 or 3): ").strip()
+            if mode in {'1', '2', '3'}:
                 break
-            print("Invalid choice. Please enter 1 or 2.")
+            print("Invalid choice. Please enter 1, 2 or 3.")
         
         if mode == '1':
             # Equation mode
             while True:
-                expr = get_equation()
+                raw_eq, expr = get_equation()
                 if expr is None:
                     continue
 
-                # Identify variables (free symbols)
-                variables = expr.free_symbols
+                # Identify variables (free symbols), sorted by name
+                vars_tuple = sorted_variables(expr)
                 
-                if not variables:
+                if not vars_tuple:
                     # Case where equation is just constants, e.g. "pi * 2"
-                    val = float(expr.evalf())
+                    val = float(expr)
                     print(f"\nComputed value: {val}")
                     print("Absolute uncertainty: 0.0 (No variables)")
                     print("Fractional uncertainty: 0.0")
                 else:
-                    values, uncertainties = get_user_inputs(variables)
+                    values, uncertainties = get_user_inputs(vars_tuple)
                     
                     try:
-                        val, abs_unc = calculate_uncertainty(expr, values, uncertainties)
+                        # Differentiate once and compile the value and all partials
+                        # into a single numeric function (cached per equation)
+                        f = compile_equation(raw_eq, vars_tuple)
+                        
+                        val, abs_unc = calculate_uncertainty(f, values, uncertainties)
+                        
+                        if not (math.isfinite(val) and math.isfinite(abs_unc)):
+                            # The compiled kernels return NaN or inf instead of
+                            # raising, e.g. sqrt(x) at x = -1 or 1/x at x = 0
+                            raise ValueError("the input is outside the domain of the equation")
                         
                         if val != 0:
                             frac_unc = abs_unc / abs(val)
@@ -221,10 +718,14 @@ def main():
                 if choice in {'no', 'n'}:
                     break
         
-        else:
+        elif mode == '2':
             # Values-only mode
             values_only_mode()
         
+        else:
+            # Monte Carlo mode
+            monte_carlo_mode()
+        
         # Ask if user wants to return to main menu or exit
         while True:
             choice = input("\nReturn to main menu? (yes/no): ").strip().lower()
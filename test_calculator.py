@@ -0,0 +1,130 @@
+import math
+import warnings
+
+import numpy as np
+import pytest
+
+import Calculator
+
+COMPILED_BACKENDS = [
+    pytest.param('numba', marks=pytest.mark.skipif(Calculator.numba is None, reason="Numba not installed")),
+    pytest.param('c', marks=pytest.mark.skipif(Calculator._C_COMPILER is None, reason="no C compiler")),
+]
+BACKENDS = COMPILED_BACKENDS + ['mpmath', 'dual']
+
+def build(raw_eq, backend, monkeypatch):
+    """Compile raw_eq with the given evaluator backend, bypassing the cache."""
+    expr = Calculator.parse_equation(raw_eq)
+    vars_tuple = Calculator.sorted_variables(expr)
+    if backend == 'dual':
+        return Calculator.build_dual_evaluator(expr, vars_tuple)
+    if backend != 'numba':
+        monkeypatch.setattr(Calculator, 'numba', None)
+    if backend == 'mpmath':
+        monkeypatch.setattr(Calculator, '_C_COMPILER', None)
+    f = Calculator.build_evaluator(expr, vars_tuple)
+    assert uses_backend(f, backend)
+    return f
+
+def uses_backend(f, backend):
+    if backend == 'numba':
+        return isinstance(f, Calculator.numba.core.dispatcher.Dispatcher)
+    if backend == 'c':
+        return hasattr(f, 'lib')
+    return True
+
+def test_plain_quadrature_sum_overflows():
+    with pytest.raises(OverflowError):
+        sum(g**2 for g in [1e200, 1e200])
+
+def test_compile_equation_does_not_overflow():
+    raw_eq = "1e200*x+1e200*y"
+    vars_tuple = Calculator.sorted_variables(Calculator.parse_equation(raw_eq))
+    f = Calculator.compile_equation(raw_eq, vars_tuple)
+    val, abs_unc = Calculator.calculate_uncertainty(f, [1.0, 1.0], [1.0, 1.0])
+    assert val == pytest.approx(2e200)
+    assert abs_unc == pytest.approx(2**0.5 * 1e200)
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_backend_does_not_overflow(backend, monkeypatch):
+    f = build("1e200*x+1e200*y", backend, monkeypatch)
+    val, abs_unc = Calculator.calculate_uncertainty(f, [1.0, 1.0], [1.0, 1.0])
+    assert val == pytest.approx(2e200)
+    assert abs_unc == pytest.approx(2**0.5 * 1e200)
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_backend_kinetic_energy(backend, monkeypatch):
+    # Example 2 in the README
+    f = build("0.5 * m * v^2", backend, monkeypatch)
+    val, abs_unc = Calculator.calculate_uncertainty(f, [2.0, 10.0], [0.1, 0.5])
+    assert val == pytest.approx(100.0)
+    assert abs_unc == pytest.approx(125**0.5)
+
+@pytest.mark.parametrize('backend', COMPILED_BACKENDS)
+@pytest.mark.parametrize('raw_eq', ["N0*exp(-t/tau)", "e^x", "2^x", "10^(m/2.5)", "exp(x)*log(y)"])
+def test_exponentials_stay_on_compiled_backend(raw_eq, backend, monkeypatch):
+    # build() asserts the compiled backend was used
+    f = build(raw_eq, backend, monkeypatch)
+    n = len(Calculator.sorted_variables(Calculator.parse_equation(raw_eq)))
+    val, abs_unc = Calculator.calculate_uncertainty(f, [1.5] * n, [0.1] * n)
+    assert abs_unc > 0
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_rational_constants_are_correctly_rounded(backend, monkeypatch):
+    f = build("x/3 + y^(1/3)", backend, monkeypatch)
+    val, abs_unc = Calculator.calculate_uncertainty(f, [1.0, 8.0], [0.0, 0.0])
+    assert val == 1 / 3 + 8.0**(1 / 3)
+
+@pytest.mark.parametrize('values, uncertainties', [
+    ([5.0, 10.5, 3.2], [0.2, 0.3, 0.1]),
+    ([100.0, 0.0, 50.0], [2.0, 1.0, 1.0]),
+    ([7.0], [0.5]),
+    ([-2.0, 4.0], [0.1, 0.2]),
+])
+def test_product_evaluator_matches_equation_pipeline(values, uncertainties):
+    xs = Calculator.sympy.symbols(f'x0:{len(values)}')
+    f = Calculator.build_evaluator(Calculator.sympy.Mul(*xs), xs)
+    expected = Calculator.calculate_uncertainty(f, values, uncertainties)
+    result = Calculator.calculate_uncertainty(Calculator.product_evaluator, values, uncertainties)
+    assert result == pytest.approx(expected)
+
+def test_product_evaluator_many_values():
+    values = [1.01] * 150
+    val, abs_unc = Calculator.calculate_uncertainty(Calculator.product_evaluator, values, [0.01] * 150)
+    assert val == pytest.approx(1.01**150)
+    assert abs_unc == pytest.approx(val * (150 * (0.01 / 1.01)**2)**0.5)
+
+@pytest.mark.parametrize('raw_eq, expected', [
+    ("0x10*y", "16*y"),
+    ("0b11*y", "3*y"),
+    ("1_000*y", "1000*y"),
+    ("1j*x", "I*x"),
+    ("x & y", "x & y"),
+])
+def test_parse_equation_matches_parse_expr(raw_eq, expected):
+    assert Calculator.parse_equation(raw_eq) == Calculator.sympy.sympify(expected)
+
+def test_parse_equation_cannot_redefine_constants(monkeypatch):
+    monkeypatch.setattr(Calculator, 'symengine', None)
+    Calculator.parse_equation("(pi := 3) + x")
+    assert Calculator.parse_equation("pi*x") == Calculator.sympy.pi * Calculator.sympy.Symbol('x')
+
+@pytest.mark.parametrize('raw_eq, value, expected', [
+    ("0.5 * m", 2.0, 1.0),
+    ("gamma(x)", 2.5, 1.329),
+])
+def test_monte_carlo_uncertainty(raw_eq, value, expected):
+    expr = Calculator.parse_equation(raw_eq)
+    vars_tuple = Calculator.sorted_variables(expr)
+    val, abs_unc = Calculator.monte_carlo_uncertainty(expr, vars_tuple, np.array([value]), np.array([0.01]),
+                                                      n_samples=1000)
+    assert val == pytest.approx(expected, rel=1e-2)
+    assert abs_unc > 0
+
+def test_monte_carlo_uncertainty_outside_domain():
+    expr = Calculator.parse_equation("sqrt(x)")
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        val, abs_unc = Calculator.monte_carlo_uncertainty(expr, (Calculator.sympy.Symbol('x'),), np.array([0.01]),
+                                                          np.array([-1.0]), n_samples=1000)
+    assert math.isnan(val)